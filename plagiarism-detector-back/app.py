@@ -1,5 +1,7 @@
 # app.py
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+import atexit
+import json
 import os
 import time
 from flask_cors import CORS
@@ -21,6 +23,18 @@ os.makedirs(REFERENCE_DIR, exist_ok=True)
 TEXT_WEIGHT = 0.8
 IMAGE_WEIGHT = 0.2
 
+# Index de références shardé (optionnel, voir utils/build_shards.py)
+# SHARD_URLS : services de shards déjà lancés, séparés par des virgules
+# SHARD_DIRS : dossiers de shards servis par des sous-processus locaux
+SHARD_URLS = [u.strip() for u in os.environ.get("SHARD_URLS", "").split(",") if u.strip()]
+SHARD_DIRS = [d.strip() for d in os.environ.get("SHARD_DIRS", "").split(",") if d.strip()]
+SHARD_TOP_K = int(os.environ.get("SHARD_TOP_K", "5"))
+if SHARD_TOP_K < 1:
+    raise ValueError(f"SHARD_TOP_K doit être supérieur ou égal à 1 (reçu {SHARD_TOP_K})")
+SIMILARITY_THRESHOLD = 0.75
+_shard_coordinator = None
+_shard_startup_error = None
+
 # Fonction manquante
 def calculate_risk_level(score):
     """Calculate risk level based on combined score"""
@@ -37,6 +51,10 @@ def calculate_risk_level(score):
     else:
         return "Critique"
 
+def _is_truthy(value):
+    """Interpret a request flag such as ?llm_summary=1"""
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
 # Import des modules avec gestion d'erreurs
 try:
     from utils.extract import extract_text_from_file, extract_text_and_images_from_pdf
@@ -44,6 +62,9 @@ try:
     from utils.vectorize import embed_sentences
     from utils.compare import compare_documents, extract_image_features, compare_image_embeddings
     from utils.reformulate import reformulate_sentence
+    from utils.shard_coordinator import (
+        ShardCoordinator, ShardUnavailableError, launch_local_shards, stop_local_shards, merge_hits
+    )
     
     # Essayer d'importer le summarizer, mais fournir une alternative si absent
     try:
@@ -89,7 +110,7 @@ try:
             }
         
         detection_summarizer = type('obj', (object,), {
-            'generate_detection_summary': lambda self, report_data, language="fr": generate_fallback_summary(report_data)
+            'generate_detection_summary': lambda self, report_data: generate_fallback_summary(report_data)
         })()
 
 except ImportError as e:
@@ -97,59 +118,91 @@ except ImportError as e:
     print("⚠️ Assurez-vous que tous les fichiers utils/*.py existent")
 
 # -------------------------------------------------------------------
-# 🔹 Route 1 : Détection de plagiat
+# 🔹 Index de références shardé
 # -------------------------------------------------------------------
-@app.route('/detect', methods=['POST'])
-def detect_plagiarism():
+def start_shards():
     """
-    Enhanced plagiarism detection with AI-powered summarization
+    Connect to the configured shards once, at application startup.
+    A failed startup is remembered and reported by every request
+    instead of being retried.
     """
-    if 'file' not in request.files:
-        return jsonify({"error": "Aucun fichier fourni"}), 400
+    global _shard_coordinator, _shard_startup_error
+    try:
+        if SHARD_URLS:
+            _shard_coordinator = ShardCoordinator(SHARD_URLS)
+        elif SHARD_DIRS:
+            print(f"🔹 Démarrage de {len(SHARD_DIRS)} shard(s) local(aux)...")
+            _shard_coordinator, processes = launch_local_shards(SHARD_DIRS)
+            atexit.register(stop_local_shards, processes)
+            print(f"✅ Shards prêts : {', '.join(_shard_coordinator.shard_urls)}")
+    except Exception as e:
+        print(f"❌ Impossible de démarrer les shards: {e}")
+        _shard_startup_error = str(e)
 
-    file = request.files['file']
-    if file.filename == "":
-        return jsonify({"error": "Nom de fichier invalide"}), 400
+def get_shard_coordinator():
+    """Return the shard coordinator, or None when the sharded index is disabled"""
+    if _shard_startup_error is not None:
+        raise ShardUnavailableError(f"Démarrage des shards échoué : {_shard_startup_error}")
+    return _shard_coordinator
 
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    file.save(file_path)
+start_shards()
 
-    try:        
-        # Extraction du texte et des images
-        text, images = extract_text_and_images_from_pdf(file_path)
-        text_clean = clean_text(text)
-        sentences = split_sentences(text_clean)
-        text_embeddings = embed_sentences(sentences)
+# -------------------------------------------------------------------
+# 🔹 Pipeline de détection (partagé par /detect et /detect/stream)
+# -------------------------------------------------------------------
 
-        all_text_matches = []
-        all_image_matches = []
-        documents_compared = 0
+def compute_scores(sentences, images, text_matches, image_matches):
+    """Compute text, image and combined scores from the matches found so far"""
+    unique_text_matches = len(set([m.get('sentence', '') for m in text_matches]))
+    text_score = round((unique_text_matches / max(len(sentences), 1)) * 100, 2)
+    text_score = min(100.0, text_score)
+
+    if images:
+        # Correction: utiliser 'image_index' au lieu de 'image'
+        unique_image_matches = len(set([f"{m.get('image_index', '')}_{m.get('matched_with_index', '')}" for m in image_matches]))
+        image_score = round((unique_image_matches / max(len(images), 1)) * 100, 2)
+        image_score = min(100.0, image_score)
+    else:
+        image_score = 0.0
 
-        # Vérifier si le dossier de référence existe et contient des fichiers
-        if not os.path.exists(REFERENCE_DIR) or not os.listdir(REFERENCE_DIR):
-            return jsonify({"error": "Aucun document de référence trouvé dans le dossier 'reference_docs'"}), 400
+    combined_score = round(text_score * TEXT_WEIGHT + image_score * IMAGE_WEIGHT, 2)
+    return text_score, image_score, combined_score
 
-        # Comparaison avec les fichiers de référence
-        for ref_file in os.listdir(REFERENCE_DIR):
-            ref_path = os.path.join(REFERENCE_DIR, ref_file)
-            
-            # Ignorer les fichiers cachés
-            if ref_file.startswith('.'):
-                continue
-                
-            try:
-                ref_text = clean_text(extract_text_from_file(ref_path))
-                ref_sentences = split_sentences(ref_text)
-                
-                if not ref_sentences:
-                    continue
-                    
+def compare_with_reference_dir(sentences, text_embeddings, images, all_text_matches, all_image_matches):
+    """
+    Compare against every file of REFERENCE_DIR, recomputed in memory.
+    Yields one "reference" event per file and returns documents_compared.
+    """
+    documents_compared = 0
+
+    # Ignorer les fichiers cachés
+    ref_files = [f for f in os.listdir(REFERENCE_DIR) if not f.startswith('.')]
+
+    yield "stage", {
+        "stage": "comparison",
+        "total_sentences": len(sentences),
+        "total_images_checked": len(images),
+        "references_total": len(ref_files),
+    }
+
+    # Comparaison avec les fichiers de référence
+    for ref_index, ref_file in enumerate(ref_files, start=1):
+        ref_path = os.path.join(REFERENCE_DIR, ref_file)
+        ref_text_matches = []
+        ref_image_matches = []
+        error = None
+
+        try:
+            ref_text = clean_text(extract_text_from_file(ref_path))
+            ref_sentences = split_sentences(ref_text)
+
+            if ref_sentences:
                 ref_embeddings = embed_sentences(ref_sentences)
 
-                matches = compare_documents(
+                ref_text_matches = compare_documents(
                     text_embeddings, ref_embeddings, sentences, ref_sentences, doc_type="text"
                 )
-                all_text_matches.extend(matches)
+                all_text_matches.extend(ref_text_matches)
 
                 # Image comparison
                 if ref_file.lower().endswith('.pdf'):
@@ -159,83 +212,299 @@ def detect_plagiarism():
                             # Use basic image comparison
                             image_embeddings = [extract_image_features(img) for img in images]
                             ref_image_embeddings = [extract_image_features(img) for img in ref_images]
-                            
-                            matches = compare_image_embeddings(
+
+                            ref_image_matches = compare_image_embeddings(
                                 image_embeddings, ref_image_embeddings, images, ref_images
                             )
-                            all_image_matches.extend(matches)
+                            all_image_matches.extend(ref_image_matches)
+                        documents_compared += 1
                     except Exception as e:
                         print(f"⚠️ Erreur lors de l'analyse des images pour {ref_file}: {e}")
-                        continue
-                
-                documents_compared += 1
-                
-            except Exception as e:
-                print(f"⚠️ Erreur avec le fichier de référence {ref_file}: {e}")
-                continue
-
-        # Calculate scores
-        unique_text_matches = len(set([m.get('sentence', '') for m in all_text_matches]))
-        text_score = round((unique_text_matches / max(len(sentences), 1)) * 100, 2)
-        text_score = min(100.0, text_score)
-
-        if images:
-            # Correction: utiliser 'image_index' au lieu de 'image'
-            unique_image_matches = len(set([f"{m.get('image_index', '')}_{m.get('matched_with_index', '')}" for m in all_image_matches]))
-            image_score = round((unique_image_matches / max(len(images), 1)) * 100, 2)
-            image_score = min(100.0, image_score)
-        else:
-            image_score = 0.0
+                        error = str(e)
+                else:
+                    documents_compared += 1
 
-        combined_score = round(text_score * TEXT_WEIGHT + image_score * IMAGE_WEIGHT, 2)
-
-        # Risk level calculation
-        risk_level = calculate_risk_level(combined_score)
-
-        # Basic report structure
-        basic_report = {
+        except Exception as e:
+            print(f"⚠️ Erreur avec le fichier de référence {ref_file}: {e}")
+            error = str(e)
+
+        text_score, image_score, combined_score = compute_scores(
+            sentences, images, all_text_matches, all_image_matches
+        )
+        reference_event = {
+            "reference": ref_file,
+            "references_done": ref_index,
+            "references_total": len(ref_files),
+            "text_matches": ref_text_matches,
+            "image_matches": ref_image_matches,
             "plagiarism_score_text": text_score,
             "plagiarism_score_image": image_score,
             "plagiarism_score_combined": combined_score,
-            "total_sentences": len(sentences),
-            "total_images_checked": len(images),
-            "text_matches": all_text_matches[:20],  # Limit for response size
-            "image_matches": all_image_matches[:20],
-            "risk_level": risk_level,
             "documents_compared": documents_compared,
         }
+        if error is not None:
+            reference_event["error"] = error
+        yield "reference", reference_event
+
+    return documents_compared
+
+def text_matches_from_hits(hits_per_sentence, sentences):
+    return [
+        {
+            "type": "text",
+            "sentence": sentences[i],
+            "similarity": round(hit["similarity"], 2),
+            "matched_with": hit["matched_with"],
+            "reference": hit["reference"],
+        }
+        for i, hits in enumerate(hits_per_sentence) for hit in hits
+    ]
+
+def image_matches_from_hits(hits_per_image, images):
+    return [
+        {
+            "image": getattr(images[i], "filename", f"image_{i}"),
+            "matched_with": hit["matched_with"],
+            "similarity": float(round(hit["similarity"], 2)),
+            "reference": hit["reference"],
+        }
+        for i, hits in enumerate(hits_per_image) for hit in hits
+    ]
 
-        # Generate AI-powered summary
-        try:
-            if SUMMARIZATION_AVAILABLE:
-                summary_report = detection_summarizer.generate_detection_summary(basic_report, language="fr")
-            else:
-                summary_report = generate_fallback_summary(basic_report)
-        except Exception as e:
-            print(f"⚠️ Erreur lors de la génération du résumé: {e}")
+def compare_with_shards(shard_coordinator, sentences, text_embeddings, images, all_text_matches, all_image_matches):
+    """
+    Compare against the sharded reference index: queries are fanned out to
+    all shards in parallel and the top-k hits per query are merged.
+    Yields one "shard" event per shard answer and returns documents_compared.
+    Raises ShardUnavailableError once all shards have answered if any of
+    them failed, so that a partial search never produces a verdict.
+    """
+    text_queries = text_embeddings.cpu().numpy() if sentences else []
+    image_queries = [extract_image_features(img) for img in images]
+    shards_total = len(shard_coordinator.shard_urls)
+
+    yield "stage", {
+        "stage": "comparison",
+        "total_sentences": len(sentences),
+        "total_images_checked": len(images),
+        "shards_total": shards_total,
+    }
+
+    shard_results = []
+    failed_shards = []
+    running_text_matches = []
+    running_image_matches = []
+    documents_compared = 0
+
+    for shards_done, (shard_url, result) in enumerate(
+        shard_coordinator.iter_search(text_queries, image_queries, SHARD_TOP_K, SIMILARITY_THRESHOLD), start=1
+    ):
+        shard_results.append(result)
+        documents_compared += result.get("documents", 0)
+        shard_text_matches = text_matches_from_hits(result.get("text", []), sentences)
+        shard_image_matches = image_matches_from_hits(result.get("images", []), images)
+        running_text_matches.extend(shard_text_matches)
+        running_image_matches.extend(shard_image_matches)
+
+        text_score, image_score, combined_score = compute_scores(
+            sentences, images, running_text_matches, running_image_matches
+        )
+        shard_event = {
+            "shard": shard_url,
+            "shards_done": shards_done,
+            "shards_total": shards_total,
+            "text_matches": shard_text_matches,
+            "image_matches": shard_image_matches,
+            "plagiarism_score_text": text_score,
+            "plagiarism_score_image": image_score,
+            "plagiarism_score_combined": combined_score,
+            "documents_compared": documents_compared,
+        }
+        if "error" in result:
+            shard_event["error"] = result["error"]
+            failed_shards.append(shard_url)
+        yield "shard", shard_event
+
+    if failed_shards:
+        raise ShardUnavailableError(f"Shards indisponibles : {', '.join(failed_shards)}")
+
+    # Fusion des top-k de tous les shards
+    all_text_matches.extend(text_matches_from_hits(
+        merge_hits(shard_results, "text", len(sentences), SHARD_TOP_K), sentences
+    ))
+    all_image_matches.extend(image_matches_from_hits(
+        merge_hits(shard_results, "images", len(images), SHARD_TOP_K), images
+    ))
+    return documents_compared
+
+def run_detection(file_path, llm_summary=False):
+    """
+    Run the plagiarism detection pipeline on an uploaded file.
+    Yields (event, payload) tuples as work progresses: "stage" events,
+    one "reference" event per reference file (or one "shard" event per
+    shard when the sharded index is enabled), then a final "report".
+    """
+    yield "stage", {"stage": "extraction"}
+
+    # Extraction du texte et des images
+    text, images = extract_text_and_images_from_pdf(file_path)
+    text_clean = clean_text(text)
+    sentences = split_sentences(text_clean)
+    text_embeddings = embed_sentences(sentences)
+
+    all_text_matches = []
+    all_image_matches = []
+
+    shard_coordinator = get_shard_coordinator()
+    if shard_coordinator is not None:
+        documents_compared = yield from compare_with_shards(
+            shard_coordinator, sentences, text_embeddings, images, all_text_matches, all_image_matches
+        )
+    else:
+        documents_compared = yield from compare_with_reference_dir(
+            sentences, text_embeddings, images, all_text_matches, all_image_matches
+        )
+
+    yield "stage", {"stage": "summary"}
+
+    # Calculate scores
+    text_score, image_score, combined_score = compute_scores(
+        sentences, images, all_text_matches, all_image_matches
+    )
+
+    # Risk level calculation
+    risk_level = calculate_risk_level(combined_score)
+
+    # Basic report structure
+    basic_report = {
+        "plagiarism_score_text": text_score,
+        "plagiarism_score_image": image_score,
+        "plagiarism_score_combined": combined_score,
+        "total_sentences": len(sentences),
+        "total_images_checked": len(images),
+        "text_matches": all_text_matches[:20],  # Limit for response size
+        "image_matches": all_image_matches[:20],
+        "risk_level": risk_level,
+        "documents_compared": documents_compared,
+    }
+
+    # Template summary (fast path, no model involved)
+    try:
+        if SUMMARIZATION_AVAILABLE:
+            summary_report = detection_summarizer.generate_detection_summary(basic_report)
+        else:
             summary_report = generate_fallback_summary(basic_report)
+    except Exception as e:
+        print(f"⚠️ Erreur lors de la génération du résumé: {e}")
+        summary_report = generate_fallback_summary(basic_report)
 
-        # Combine basic report with summary
-        final_report = {**basic_report, **summary_report}
+    # Combine basic report with summary
+    final_report = {**basic_report, **summary_report}
 
-        # Nettoyer le fichier uploadé
-        try:
-            os.remove(file_path)
-        except:
-            pass
+    # Optional AI-powered summary, generated in the background and
+    # fetched later through /summary/<summary_id>
+    if SUMMARIZATION_AVAILABLE and llm_summary:
+        summary_id = detection_summarizer.submit_llm_summary(basic_report)
+        final_report["llm_summary"] = {"id": summary_id, "status": "pending"}
+
+    yield "report", final_report
+
+def save_upload():
+    """
+    Validate and save the uploaded file.
+    Returns (file_path, None) on success or (None, error_response).
+    """
+    if 'file' not in request.files:
+        return None, (jsonify({"error": "Aucun fichier fourni"}), 400)
+
+    file = request.files['file']
+    if file.filename == "":
+        return None, (jsonify({"error": "Nom de fichier invalide"}), 400)
+
+    # Vérifier si le dossier de référence existe et contient des fichiers
+    # (inutile lorsque les références sont servies par l'index shardé)
+    sharded = bool(SHARD_URLS or SHARD_DIRS)
+    if not sharded and (not os.path.exists(REFERENCE_DIR) or not os.listdir(REFERENCE_DIR)):
+        return None, (jsonify({"error": "Aucun document de référence trouvé dans le dossier 'reference_docs'"}), 400)
+
+    file_path = os.path.join(UPLOAD_DIR, file.filename)
+    file.save(file_path)
+    return file_path, None
+
+def remove_upload(file_path):
+    # Nettoyer le fichier uploadé
+    try:
+        os.remove(file_path)
+    except:
+        pass
+
+# -------------------------------------------------------------------
+# 🔹 Route 1 : Détection de plagiat
+# -------------------------------------------------------------------
+@app.route('/detect', methods=['POST'])
+def detect_plagiarism():
+    """
+    Enhanced plagiarism detection. A template summary is always included;
+    pass llm_summary=1 to also queue an AI-powered summary.
+    """
+    file_path, error_response = save_upload()
+    if error_response:
+        return error_response
+
+    try:
+        final_report = None
+        for event, payload in run_detection(file_path, _is_truthy(request.values.get("llm_summary"))):
+            if event == "report":
+                final_report = payload
 
         return jsonify(final_report), 200
 
+    except ShardUnavailableError as e:
+        return jsonify({"error": str(e)}), 503
+
     except Exception as e:
-        # Nettoyer le fichier uploadé en cas d'erreur
-        try:
-            if 'file_path' in locals():
-                os.remove(file_path)
-        except:
-            pass
-            
         return jsonify({"error": f"Erreur interne : {str(e)}"}), 500
 
+    finally:
+        remove_upload(file_path)
+
+# -------------------------------------------------------------------
+# 🔹 Route 1 bis : Détection de plagiat en streaming (Server-Sent Events)
+# -------------------------------------------------------------------
+def format_sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.route('/detect/stream', methods=['POST'])
+def detect_plagiarism_stream():
+    """
+    Same detection as /detect, streamed as Server-Sent Events: stage
+    progress, per-reference (or per-shard) matches with running scores,
+    then the final report (identical to the /detect response) as a
+    "report" event.
+    """
+    file_path, error_response = save_upload()
+    if error_response:
+        return error_response
+
+    llm_summary = _is_truthy(request.values.get("llm_summary"))
+
+    def generate():
+        try:
+            for event, payload in run_detection(file_path, llm_summary):
+                yield format_sse(event, payload)
+        except ShardUnavailableError as e:
+            yield format_sse("error", {"error": str(e)})
+        except Exception as e:
+            yield format_sse("error", {"error": f"Erreur interne : {str(e)}"})
+        finally:
+            remove_upload(file_path)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # -------------------------------------------------------------------
 # 🔹 Route 2 : Reformulation automatique
 # -------------------------------------------------------------------
@@ -269,6 +538,22 @@ def health_check():
         "reference_docs_count": len([f for f in os.listdir(REFERENCE_DIR) if not f.startswith('.')]) if os.path.exists(REFERENCE_DIR) else 0
     }), 200
 
+# -------------------------------------------------------------------
+# 🔹 Route 4 : Résumé IA asynchrone
+# -------------------------------------------------------------------
+@app.route("/summary/<summary_id>", methods=["GET"])
+def get_llm_summary(summary_id):
+    # Le résumé IA est généré en anglais (champ "language"), contrairement
+    # au résumé par template inclus dans la réponse de /detect
+    if not SUMMARIZATION_AVAILABLE:
+        return jsonify({"error": "Résumé IA indisponible"}), 503
+
+    result = detection_summarizer.get_llm_summary(summary_id)
+    if result is None:
+        return jsonify({"error": "Résumé introuvable"}), 404
+
+    return jsonify({"id": summary_id, **result}), 200
+
 # -------------------------------------------------------------------
 # 🚀 Lancement du serveur Flask
 # -------------------------------------------------------------------
@@ -277,4 +562,5 @@ if __name__ == "__main__":
     print(f"📁 Dossier des références: {REFERENCE_DIR}")
     print(f"📁 Dossier des uploads: {UPLOAD_DIR}")
     print("📍 API accessible sur: http://localhost:5000")
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    # Le reloader réimporterait app.py et relancerait les shards locaux
+    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=not SHARD_DIRS)
\ No newline at end of file
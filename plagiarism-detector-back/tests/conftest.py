@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les modules utils.* sont importés depuis plagiarism-detector-back
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,177 @@
+import socket
+import numpy as np
+import pytest
+import utils.shards as shards
+from utils.shards import ShardWriter, ShardIndex, normalize_rows, search_block_rows, shard_for
+from utils.shard_coordinator import (
+    ShardCoordinator, ShardUnavailableError, launch_local_shards, stop_local_shards, merge_hits
+)
+
+DIM = 16
+IMAGE_DIM = 8
+NUM_SHARDS = 3
+
+
+def build_corpus(tmp_path, num_docs=10, rows_per_doc=20, num_shards=NUM_SHARDS, seed=0):
+    """
+    Write random reference vectors into num_shards shards; returns shard
+    dirs, the flat corpus, its labels and the reference of each row.
+    """
+    rng = np.random.default_rng(seed)
+    shard_dirs = [str(tmp_path / f"shard_{i}") for i in range(num_shards)]
+    writers = [ShardWriter(d) for d in shard_dirs]
+    vectors, labels, references = [], [], []
+    for doc in range(num_docs):
+        ref_file = f"doc{doc}.pdf"
+        doc_vectors = rng.normal(size=(rows_per_doc, DIM)).astype(np.float32)
+        doc_labels = [f"phrase {doc}-{j} é" for j in range(rows_per_doc)]
+        writers[shard_for(ref_file, num_shards)].add_document(
+            ref_file, doc_labels, doc_vectors,
+            [f"{ref_file}#img{j}" for j in range(2)], rng.normal(size=(2, IMAGE_DIM))
+        )
+        vectors.append(doc_vectors)
+        labels.extend(doc_labels)
+        references.extend([ref_file] * rows_per_doc)
+    for writer in writers:
+        writer.close()
+    return shard_dirs, np.concatenate(vectors), labels, references
+
+
+def brute_force_top_k(corpus, labels, references, queries, k):
+    """Best row of each reference document, then the top-k documents"""
+    sims = normalize_rows(queries) @ normalize_rows(corpus).T
+    expected = []
+    for row in sims:
+        best_per_reference = {}
+        for i in np.argsort(-row):
+            best_per_reference.setdefault(references[i], labels[i])
+        expected.append(list(best_per_reference.values())[:k])
+    return expected
+
+
+def test_chunked_search_matches_brute_force(tmp_path, monkeypatch):
+    monkeypatch.setattr(shards, "SEARCH_CHUNK_ROWS", 7)
+    shard_dirs, corpus, labels, references = build_corpus(tmp_path, num_shards=1)
+    queries = corpus[[3, 50, 150]] + 0.01
+
+    hits = ShardIndex(shard_dirs[0]).search_text(queries, k=4, threshold=-1.0)
+
+    assert [[h["matched_with"] for h in row] for row in hits] == \
+        brute_force_top_k(corpus, labels, references, queries, 4)
+    assert hits[0][0]["reference"] == "doc0.pdf"
+
+
+def test_block_size_follows_query_count(tmp_path, monkeypatch):
+    monkeypatch.setattr(shards, "SEARCH_BLOCK_ELEMENTS", 40)
+    assert search_block_rows(4) == 10
+    assert search_block_rows(1000) == 1
+
+    shard_dirs, corpus, labels, references = build_corpus(tmp_path, num_shards=1)
+    queries = corpus[[3, 50, 150, 199]] + 0.01
+    hits = ShardIndex(shard_dirs[0]).search_text(queries, k=4, threshold=-1.0)
+
+    assert [[h["matched_with"] for h in row] for row in hits] == \
+        brute_force_top_k(corpus, labels, references, queries, 4)
+
+
+def test_k_larger_than_row_count(tmp_path):
+    shard_dirs, corpus, labels, references = build_corpus(tmp_path, num_docs=3, rows_per_doc=5, num_shards=1)
+
+    hits = ShardIndex(shard_dirs[0]).search_text(corpus[:2], k=50, threshold=-1.0)
+
+    assert [len(row) for row in hits] == [3, 3]
+    assert [h["matched_with"] for h in hits[0]] == brute_force_top_k(corpus, labels, references, corpus[:1], 50)[0]
+
+
+def test_one_hit_per_reference_with_repeated_sentence(tmp_path, monkeypatch):
+    monkeypatch.setattr(shards, "SEARCH_CHUNK_ROWS", 3)
+    rng = np.random.default_rng(1)
+    repeated = rng.normal(size=DIM).astype(np.float32)
+    # doc0 contient la même phrase plusieurs fois, à cheval sur plusieurs blocs
+    doc0 = np.stack([repeated, rng.normal(size=DIM), repeated, repeated, rng.normal(size=DIM), repeated])
+    doc1 = np.stack([rng.normal(size=DIM), repeated * 0.9 + rng.normal(size=DIM) * 0.1])
+    writer = ShardWriter(str(tmp_path / "shard"))
+    writer.add_document("doc0.pdf", ["répétée", "a", "répétée", "répétée", "b", "répétée"], doc0)
+    writer.add_document("doc1.pdf", ["c", "proche"], doc1)
+    writer.close()
+
+    hits = ShardIndex(str(tmp_path / "shard")).search_text(repeated[None, :], k=5, threshold=0.5)[0]
+
+    assert [(h["reference"], h["matched_with"]) for h in hits] == [("doc0.pdf", "répétée"), ("doc1.pdf", "proche")]
+
+
+def test_threshold_and_invalid_k(tmp_path):
+    shard_dirs, corpus, _, _ = build_corpus(tmp_path, num_docs=2, num_shards=1)
+    index = ShardIndex(shard_dirs[0])
+
+    hits = index.search_text(corpus[:1], k=5, threshold=0.999)
+    assert [h["matched_with"] for h in hits[0]] == ["phrase 0-0 é"]
+
+    with pytest.raises(ValueError):
+        index.search_text(corpus[:1], k=0)
+
+
+def test_empty_shard(tmp_path):
+    shard_dir = str(tmp_path / "empty")
+    ShardWriter(shard_dir).close()
+    index = ShardIndex(shard_dir)
+
+    assert index.search_text(np.ones((2, DIM)), k=3) == [[], []]
+    assert index.search_images([], k=3) == []
+
+
+def test_local_subprocess_shards_match_brute_force(tmp_path):
+    shard_dirs, corpus, labels, references = build_corpus(tmp_path)
+    empty_dir = str(tmp_path / "empty")
+    ShardWriter(empty_dir).close()
+    queries = corpus[[3, 50, 150, 199]] + 0.01
+
+    coordinator, processes = launch_local_shards(shard_dirs + [empty_dir], startup_timeout=60)
+    try:
+        assert len(set(coordinator.shard_urls)) == NUM_SHARDS + 1
+        text_hits, image_hits = coordinator.search(queries, [], k=4, threshold=-1.0)
+
+        assert [[h["matched_with"] for h in row] for row in text_hits] == \
+            brute_force_top_k(corpus, labels, references, queries, 4)
+        assert image_hits == []
+    finally:
+        stop_local_shards(processes)
+
+
+def unused_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_failed_shard_is_reported(tmp_path):
+    shard_dirs, corpus, _, _ = build_corpus(tmp_path, num_shards=1)
+    dead_url = f"http://127.0.0.1:{unused_port()}"
+
+    coordinator, processes = launch_local_shards(shard_dirs, startup_timeout=60)
+    try:
+        coordinator = ShardCoordinator(coordinator.shard_urls + [dead_url], timeout=5)
+        results = dict(coordinator.iter_search(corpus[:1], [], k=2, threshold=-1.0))
+
+        assert "error" in results[dead_url]
+        assert len(merge_hits([r for r in results.values()], "text", 1, 2)[0]) == 2
+        with pytest.raises(ShardUnavailableError):
+            coordinator.search(corpus[:1], [], k=2, threshold=-1.0)
+    finally:
+        stop_local_shards(processes)
+
+
+def test_merge_hits_keeps_best_hit_per_reference():
+    shard_a = {"text": [[
+        {"similarity": 0.9, "matched_with": "x", "reference": "doc0.pdf"},
+        {"similarity": 0.8, "matched_with": "y", "reference": "doc1.pdf"},
+    ]]}
+    shard_b = {"text": [[
+        {"similarity": 0.95, "matched_with": "z", "reference": "doc0.pdf"},
+        {"similarity": 0.7, "matched_with": "w", "reference": "doc2.pdf"},
+    ]]}
+
+    merged = merge_hits([shard_a, shard_b], "text", 1, 5)[0]
+
+    assert [(h["reference"], h["matched_with"]) for h in merged] == \
+        [("doc0.pdf", "z"), ("doc1.pdf", "y"), ("doc2.pdf", "w")]
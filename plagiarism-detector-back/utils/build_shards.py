@@ -0,0 +1,65 @@
+# utils/build_shards.py
+import argparse
+import os
+from utils.extract import extract_text_from_file, extract_text_and_images_from_pdf
+from utils.preprocess import clean_text, split_sentences
+from utils.vectorize import embed_sentences
+from utils.image import extract_image_features
+from utils.shards import ShardWriter, shard_for
+
+# --- Dossiers ---
+REFERENCE_DIR = "reference_docs"
+OUTPUT_DIR = "reference_shards"
+
+
+def build_shards(reference_dir=REFERENCE_DIR, output_dir=OUTPUT_DIR, num_shards=4):
+    """
+    Index every reference document into num_shards shard directories
+    (output_dir/shard_000, ...) and return their paths.
+    """
+    shard_dirs = [os.path.join(output_dir, f"shard_{i:03d}") for i in range(num_shards)]
+    writers = [ShardWriter(shard_dir) for shard_dir in shard_dirs]
+
+    try:
+        for ref_file in os.listdir(reference_dir):
+            # Ignorer les fichiers cachés
+            if ref_file.startswith('.'):
+                continue
+
+            ref_path = os.path.join(reference_dir, ref_file)
+            print(f"🔹 Traitement de : {ref_file}")
+            try:
+                ref_sentences = split_sentences(clean_text(extract_text_from_file(ref_path)))
+                if not ref_sentences:
+                    print("⚠️ Aucun texte trouvé pour ce fichier.")
+                    continue
+                ref_embeddings = embed_sentences(ref_sentences).cpu().numpy()
+
+                image_names, image_embeddings = [], []
+                if ref_file.lower().endswith('.pdf'):
+                    _, ref_images = extract_text_and_images_from_pdf(ref_path)
+                    image_names = [getattr(img, "filename", f"ref_image_{j}") for j, img in enumerate(ref_images)]
+                    image_embeddings = [extract_image_features(img) for img in ref_images]
+
+                writers[shard_for(ref_file, num_shards)].add_document(
+                    ref_file, ref_sentences, ref_embeddings, image_names, image_embeddings
+                )
+            except Exception as e:
+                print(f"⚠️ Erreur avec le fichier de référence {ref_file}: {e}")
+    finally:
+        for writer in writers:
+            writer.close()
+
+    return shard_dirs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construit l'index de références shardé")
+    parser.add_argument("--reference-dir", default=REFERENCE_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--num-shards", type=int, default=4)
+    args = parser.parse_args()
+
+    for shard_dir in build_shards(args.reference_dir, args.output_dir, args.num_shards):
+        print(f"✅ Shard prêt : {shard_dir}")
+    print("\n🎉 Indexation terminée ! Lancez les shards avec `python -m utils.shard_server`.")
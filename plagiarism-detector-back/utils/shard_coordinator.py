@@ -0,0 +1,167 @@
+# utils/shard_coordinator.py
+import heapq
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.shards import normalize_rows, encode_matrix
+from utils.shard_server import PORT_ANNOUNCE_PREFIX
+
+
+class ShardUnavailableError(Exception):
+    """Raised when one or more shards could not answer a query"""
+
+
+class ShardCoordinator:
+    """
+    Fan queries out to every shard service in parallel and merge the
+    top-k hits. Shards can be local subprocesses or remote hosts.
+    """
+
+    def __init__(self, shard_urls, timeout=60):
+        self.shard_urls = [url.rstrip("/") for url in shard_urls]
+        self.timeout = timeout
+
+    def _request(self, url, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(url + path, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def iter_search(self, text_queries, image_queries, k=5, threshold=0.75):
+        """
+        Query all shards in parallel, yielding (shard_url, result) as each
+        shard answers. A failed shard yields a result with an "error" key.
+        """
+        if k < 1:
+            raise ValueError(f"k doit être supérieur ou égal à 1 (reçu {k})")
+
+        # Les requêtes voyagent en float32 encodés en base64 plutôt qu'en
+        # listes JSON de flottants (environ 4 fois plus compact)
+        payload = {
+            "text_queries": encode_matrix(normalize_rows(text_queries)) if len(text_queries) else None,
+            "image_queries": encode_matrix(normalize_rows(image_queries)) if len(image_queries) else None,
+            "k": k,
+            "threshold": threshold,
+        }
+        with ThreadPoolExecutor(max_workers=max(len(self.shard_urls), 1)) as pool:
+            futures = {pool.submit(self._request, url, "/search", payload): url for url in self.shard_urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    yield url, future.result()
+                except Exception as e:
+                    print(f"⚠️ Erreur avec le shard {url}: {e}")
+                    yield url, {"error": str(e)}
+
+    def search(self, text_queries, image_queries, k=5, threshold=0.75):
+        """
+        Query all shards and return the merged top-k text and image hits.
+        Raises ShardUnavailableError if any shard failed to answer.
+        """
+        results = []
+        failed = []
+        for url, result in self.iter_search(text_queries, image_queries, k, threshold):
+            if "error" in result:
+                failed.append(url)
+            results.append(result)
+        if failed:
+            raise ShardUnavailableError(f"Shards indisponibles : {', '.join(failed)}")
+        return (merge_hits(results, "text", len(text_queries), k),
+                merge_hits(results, "images", len(image_queries), k))
+
+
+def merge_hits(shard_results, key, num_queries, k):
+    """
+    Merge per-shard hit lists into the global top-k per query, keeping
+    only the best hit of each reference document.
+    """
+    merged = [{} for _ in range(num_queries)]
+    for result in shard_results:
+        for query_index, hits in enumerate(result.get(key, [])):
+            best_per_reference = merged[query_index]
+            for hit in hits:
+                current = best_per_reference.get(hit["reference"])
+                if current is None or hit["similarity"] > current["similarity"]:
+                    best_per_reference[hit["reference"]] = hit
+    return [heapq.nlargest(k, hits.values(), key=lambda hit: hit["similarity"]) for hits in merged]
+
+
+def _read_announced_port(process, port_queue):
+    for line in process.stdout:
+        if line.startswith(PORT_ANNOUNCE_PREFIX):
+            port_queue.put(int(line.split()[1]))
+            return
+    port_queue.put(None)
+
+
+def launch_local_shards(shard_dirs, host="127.0.0.1", startup_timeout=120):
+    """
+    Start one shard service subprocess per shard directory, each on a free
+    port chosen by the system, and wait until they all answer.
+    Returns (coordinator, processes).
+    """
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    processes = []
+    port_queues = []
+    for shard_dir in shard_dirs:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "utils.shard_server",
+             "--shard-dir", os.path.abspath(shard_dir), "--host", host, "--port", "0"],
+            cwd=backend_dir,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        port_queue = queue.Queue()
+        threading.Thread(target=_read_announced_port, args=(process, port_queue), daemon=True).start()
+        processes.append(process)
+        port_queues.append(port_queue)
+
+    deadline = time.time() + startup_timeout
+    try:
+        urls = []
+        for shard_dir, process, port_queue in zip(shard_dirs, processes, port_queues):
+            try:
+                port = port_queue.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                port = None
+            if port is None:
+                raise RuntimeError(f"Le shard {shard_dir} n'a pas démarré")
+            urls.append(f"http://{host}:{port}")
+
+        coordinator = ShardCoordinator(urls)
+        for url, process in zip(urls, processes):
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Le shard {url} s'est arrêté au démarrage")
+                try:
+                    coordinator._request(url, "/health")
+                    break
+                except Exception:
+                    if time.time() > deadline:
+                        raise RuntimeError(f"Le shard {url} ne répond pas")
+                    time.sleep(0.2)
+            # La réponse doit venir de notre sous-processus, pas d'un ancien shard
+            if process.poll() is not None:
+                raise RuntimeError(f"Le shard {url} s'est arrêté au démarrage")
+    except Exception:
+        stop_local_shards(processes)
+        raise
+
+    return coordinator, processes
+
+
+def stop_local_shards(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,57 @@
+# utils/shard_server.py
+import argparse
+import sys
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+from utils.shards import ShardIndex, decode_matrix
+
+# Première ligne écrite sur stdout par le service : le port effectivement lié
+# (lu par launch_local_shards lorsque le shard est lancé avec --port 0)
+PORT_ANNOUNCE_PREFIX = "SHARD_PORT"
+
+
+def create_shard_app(shard_dir):
+    """Small search service answering queries for a single shard"""
+    index = ShardIndex(shard_dir)
+    app = Flask(__name__)
+
+    @app.route("/health", methods=["GET"])
+    def health_check():
+        return jsonify({
+            "status": "healthy",
+            "documents": len(index.documents),
+            "text_count": index.info["text_count"],
+            "image_count": index.info["image_count"],
+        }), 200
+
+    @app.route("/search", methods=["POST"])
+    def search():
+        data = request.get_json() or {}
+        k = int(data.get("k", 5))
+        threshold = float(data.get("threshold", 0.75))
+        if k < 1:
+            return jsonify({"error": "k doit être supérieur ou égal à 1"}), 400
+
+        try:
+            return jsonify({
+                "documents": len(index.documents),
+                "text": index.search_text(decode_matrix(data.get("text_queries")), k, threshold),
+                "images": index.search_images(decode_matrix(data.get("image_queries")), k, threshold),
+            }), 200
+        except Exception as e:
+            return jsonify({"error": f"Erreur de recherche : {str(e)}"}), 500
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service de recherche pour un shard de références")
+    parser.add_argument("--shard-dir", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 = port libre choisi par le système")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, create_shard_app(args.shard_dir), threaded=True)
+    print(f"{PORT_ANNOUNCE_PREFIX} {server.server_port}", flush=True)
+    print(f"🚀 Shard {args.shard_dir} accessible sur: http://{args.host}:{server.server_port}", file=sys.stderr)
+    server.serve_forever()
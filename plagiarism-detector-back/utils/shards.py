@@ -0,0 +1,224 @@
+# utils/shards.py
+import base64
+import json
+import os
+import zlib
+import numpy as np
+
+# Fichiers d'un shard : vecteurs float32 bruts et offsets int64 des lignes de
+# métadonnées (tous deux lus en memory-map), plus les métadonnées en jsonl
+SHARD_INFO = "shard.json"
+TEXT_VECTORS = "text.f32"
+TEXT_OFFSETS = "text.idx"
+TEXT_META = "text.jsonl"
+IMAGE_VECTORS = "image.f32"
+IMAGE_OFFSETS = "image.idx"
+IMAGE_META = "image.jsonl"
+SHARD_FILES = {
+    "text": (TEXT_VECTORS, TEXT_OFFSETS, TEXT_META),
+    "image": (IMAGE_VECTORS, IMAGE_OFFSETS, IMAGE_META),
+}
+
+# Nombre maximal de lignes lues depuis le disque à chaque passe de recherche
+SEARCH_CHUNK_ROWS = 65536
+# Budget de la matrice de scores requêtes × lignes d'un bloc (4M float32 = 16 Mo) :
+# plus il y a de requêtes, plus les blocs sont petits
+SEARCH_BLOCK_ELEMENTS = 4 * 1024 * 1024
+
+
+def shard_for(ref_file, num_shards):
+    """Stable assignment of a reference document to a shard"""
+    return zlib.crc32(ref_file.encode("utf-8")) % num_shards
+
+
+def normalize_rows(vectors):
+    """L2-normalize embeddings so that a dot product is a cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def search_block_rows(num_queries):
+    """Rows per search block so that the score matrix stays within budget"""
+    return max(1, min(SEARCH_CHUNK_ROWS, SEARCH_BLOCK_ELEMENTS // max(num_queries, 1)))
+
+
+def encode_matrix(vectors):
+    """Serialize a float32 matrix for JSON transport (base64 bytes + shape)"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    return {
+        "shape": list(vectors.shape),
+        "data": base64.b64encode(vectors.tobytes()).decode("ascii"),
+    }
+
+
+def decode_matrix(payload):
+    """Inverse of encode_matrix"""
+    if not payload:
+        return np.empty((0, 0), dtype=np.float32)
+    data = base64.b64decode(payload["data"])
+    return np.frombuffer(data, dtype=np.float32).reshape(payload["shape"])
+
+
+class ShardWriter:
+    """
+    Append reference documents to a shard directory. Vectors are streamed
+    to disk as they are added, so building a shard never needs the whole
+    shard in memory.
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        os.makedirs(shard_dir, exist_ok=True)
+        # *_doc_starts : première ligne de chaque document (ses lignes sont contiguës)
+        self.info = {"documents": [], "text_count": 0, "text_dim": None, "text_doc_starts": [],
+                     "image_count": 0, "image_dim": None, "image_doc_starts": []}
+        self._files = {}
+        for kind, names in SHARD_FILES.items():
+            self._files[kind] = tuple(open(os.path.join(shard_dir, name), "wb") for name in names)
+        info_path = os.path.join(shard_dir, SHARD_INFO)
+        if os.path.exists(info_path):
+            os.remove(info_path)
+
+    def add_document(self, ref_file, sentences, text_embeddings, image_names=(), image_embeddings=()):
+        self._append("text", ref_file, sentences, text_embeddings)
+        self._append("image", ref_file, image_names, image_embeddings)
+        self.info["documents"].append(ref_file)
+
+    def _append(self, kind, ref_file, labels, embeddings):
+        if len(labels) == 0:
+            return
+        vectors = normalize_rows(embeddings)
+        dim_key, count_key = f"{kind}_dim", f"{kind}_count"
+        if self.info[dim_key] is None:
+            self.info[dim_key] = int(vectors.shape[1])
+        elif self.info[dim_key] != vectors.shape[1]:
+            raise ValueError(f"Dimension incohérente pour {ref_file}: {vectors.shape[1]} != {self.info[dim_key]}")
+
+        vectors_file, offsets_file, meta_file = self._files[kind]
+        vectors_file.write(vectors.tobytes())
+        offsets = []
+        for label in labels:
+            offsets.append(meta_file.tell())
+            line = json.dumps({"reference": ref_file, "label": label}, ensure_ascii=False) + "\n"
+            meta_file.write(line.encode("utf-8"))
+        offsets_file.write(np.asarray(offsets, dtype=np.int64).tobytes())
+        self.info[f"{kind}_doc_starts"].append(self.info[count_key])
+        self.info[count_key] += len(labels)
+
+    def close(self):
+        for files in self._files.values():
+            for f in files:
+                f.close()
+        with open(os.path.join(self.shard_dir, SHARD_INFO), "w", encoding="utf-8") as f:
+            json.dump(self.info, f, ensure_ascii=False)
+
+
+class ShardIndex:
+    """
+    Read-only view of one shard. Vectors and metadata offsets are
+    memory-mapped; metadata rows are only read from disk for the hits.
+    """
+
+    def __init__(self, shard_dir):
+        with open(os.path.join(shard_dir, SHARD_INFO), encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.documents = self.info["documents"]
+        self._indexes = {kind: self._open(shard_dir, kind) for kind in SHARD_FILES}
+
+    def _open(self, shard_dir, kind):
+        count, dim = self.info[f"{kind}_count"], self.info[f"{kind}_dim"]
+        if not count:
+            return None
+        vectors_name, offsets_name, meta_name = SHARD_FILES[kind]
+        vectors = np.memmap(os.path.join(shard_dir, vectors_name), dtype=np.float32,
+                            mode="r", shape=(count, dim))
+        offsets = np.memmap(os.path.join(shard_dir, offsets_name), dtype=np.int64,
+                            mode="r", shape=(count,))
+        doc_starts = np.asarray(self.info[f"{kind}_doc_starts"], dtype=np.int64)
+        return vectors, offsets, doc_starts, os.path.join(shard_dir, meta_name)
+
+    def search_text(self, queries, k=5, threshold=0.75):
+        return self._search(self._indexes["text"], queries, k, threshold)
+
+    def search_images(self, queries, k=5, threshold=0.75):
+        return self._search(self._indexes["image"], queries, k, threshold)
+
+    def _search(self, index, queries, k, threshold):
+        """
+        Return, for each query, up to k hits above threshold as dicts with
+        the similarity, the matched label and its reference document.
+        Like compare_documents, only the best row of each reference
+        document is kept, so a query gets at most one hit per document.
+        """
+        if k < 1:
+            raise ValueError(f"k doit être supérieur ou égal à 1 (reçu {k})")
+        if len(queries) == 0:
+            return []
+        queries = normalize_rows(queries)
+        if index is None:
+            return [[] for _ in range(len(queries))]
+        vectors, offsets, doc_starts, meta_path = index
+        num_queries = len(queries)
+        query_range = np.arange(num_queries)
+
+        best_scores = np.empty((num_queries, 0), dtype=np.float32)
+        best_rows = np.empty((num_queries, 0), dtype=np.int64)
+        best_docs = np.empty((num_queries, 0), dtype=np.int64)
+        # Parcours par blocs : seul un bloc du memory-map est chargé à la fois,
+        # et block_scores est la seule matrice requêtes × lignes allouée
+        block_rows = search_block_rows(num_queries)
+        for start in range(0, len(vectors), block_rows):
+            end = min(start + block_rows, len(vectors))
+            block_scores = queries @ np.asarray(vectors[start:end]).T
+
+            # Meilleure ligne de chaque document présent dans le bloc
+            first_doc = np.searchsorted(doc_starts, start, side="right") - 1
+            last_doc = np.searchsorted(doc_starts, end, side="left")
+            docs = np.arange(first_doc, last_doc)
+            segment_starts = np.maximum(doc_starts[first_doc:last_doc], start) - start
+            segment_ends = np.append(segment_starts[1:], end - start)
+            doc_scores = np.empty((num_queries, len(docs)), dtype=np.float32)
+            doc_rows = np.empty((num_queries, len(docs)), dtype=np.int64)
+            for j, (a, b) in enumerate(zip(segment_starts, segment_ends)):
+                best_in_segment = block_scores[:, a:b].argmax(axis=1)
+                doc_scores[:, j] = block_scores[query_range, a + best_in_segment]
+                doc_rows[:, j] = start + a + best_in_segment
+
+            # Un document à cheval sur le bloc précédent : garder sa meilleure ligne
+            q_idx, col = np.nonzero(best_docs == docs[0])
+            better = best_scores[q_idx, col] > doc_scores[q_idx, 0]
+            doc_scores[q_idx[better], 0] = best_scores[q_idx[better], col[better]]
+            doc_rows[q_idx[better], 0] = best_rows[q_idx[better], col[better]]
+            best_scores[q_idx, col] = -np.inf
+
+            scores = np.concatenate([best_scores, doc_scores], axis=1)
+            rows = np.concatenate([best_rows, doc_rows], axis=1)
+            doc_ids = np.concatenate([best_docs, np.broadcast_to(docs, doc_scores.shape)], axis=1)
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+                doc_ids = np.take_along_axis(doc_ids, keep, axis=1)
+            best_scores, best_rows, best_docs = scores, rows, doc_ids
+
+        results = []
+        with open(meta_path, "rb") as meta_file:
+            for scores, rows in zip(best_scores, best_rows):
+                hits = []
+                for position in np.argsort(-scores):
+                    score = float(scores[position])
+                    if score < threshold:
+                        break
+                    meta_file.seek(int(offsets[int(rows[position])]))
+                    entry = json.loads(meta_file.readline().decode("utf-8"))
+                    hits.append({
+                        "similarity": score,
+                        "matched_with": entry["label"],
+                        "reference": entry["reference"],
+                    })
+                results.append(hits)
+        return results
@@ -1,57 +1,144 @@
 # utils/summarization.py
-from transformers import pipeline
-import torch
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+
+# Modèle plus léger pour la summarization
+SUMMARY_MODEL_NAME = "Falconsai/text_summarization"
+# Langue des résumés LLM : le modèle est anglophone et le texte d'analyse
+# préparé par _prepare_analysis_text est en anglais
+SUMMARY_LANGUAGE = "en"
+# Nombre maximal de rapports résumés en un seul passage du modèle
+SUMMARY_BATCH_SIZE = 8
+# Nombre maximal de résumés LLM conservés en mémoire
+MAX_STORED_SUMMARIES = 500
+
 
 class DetectionSummarizer:
-    def __init__(self):
-        # Utiliser un modèle plus léger pour la summarization
+    def __init__(self, model_name=SUMMARY_MODEL_NAME, batch_size=SUMMARY_BATCH_SIZE):
+        # Le modèle n'est chargé qu'à la première demande de résumé LLM :
+        # le chemin par template (utilisé par défaut) n'a besoin d'aucun modèle.
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.summarizer = None
+        self.model_loaded = False
+        self._model_failed = False
+
+        self._pending = queue.Queue()
+        self._results = OrderedDict()
+        self._results_lock = threading.Lock()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def _load_model(self):
+        """Load the summarization pipeline on first use"""
+        if self.model_loaded or self._model_failed:
+            return self.model_loaded
         try:
+            from transformers import pipeline
+
             self.summarizer = pipeline(
                 "summarization",
-                model="Falconsai/text_summarization",  # Modèle plus léger
-                tokenizer="Falconsai/text_summarization",
+                model=self.model_name,
+                tokenizer=self.model_name,
                 framework="pt"
             )
             self.model_loaded = True
             print("✅ Modèle de summarization chargé avec succès")
         except Exception as e:
             print(f"⚠️ Impossible de charger le modèle de summarization: {e}")
-            self.model_loaded = False
-    
-    def generate_detection_summary(self, report_data, language="fr"):
+            self._model_failed = True
+        return self.model_loaded
+
+    def generate_detection_summary(self, report_data):
         """
-        Generate AI-powered summary of plagiarism detection results
+        Generate the template-based summary of plagiarism detection results.
+        This is the fast path used synchronously by /detect; AI-powered
+        summaries are produced separately via submit_llm_summary().
         """
         try:
-            # Préparer le texte d'analyse
-            analysis_text = self._prepare_analysis_text(report_data)
-            
-            if self.model_loaded and language == "en":
-                # Générer le résumé avec le modèle (seulement pour l'anglais)
-                summary_result = self.summarizer(
-                    analysis_text,
-                    max_length=150,
-                    min_length=50,
-                    do_sample=False
-                )
-                summary = summary_result[0]['summary_text']
-            else:
-                # Fallback en français ou si modèle non chargé
-                summary = self._generate_french_summary_fallback(report_data)
-            
-            # Générer les recommandations
-            recommendations = self._generate_recommendations(report_data)
-            
+            return self._generate_template_summary(report_data)
+        except Exception as e:
+            print(f"❌ Erreur lors de la génération du résumé: {e}")
             return {
-                "summary": summary,
-                "recommendations": recommendations,
-                "key_findings": self._extract_key_findings(report_data)
+                "summary": self._generate_french_summary_fallback(report_data),
+                "recommendations": [],
+                "key_findings": {}
             }
-            
+
+    def submit_llm_summary(self, report_data):
+        """
+        Queue a report for asynchronous AI-powered summarization.
+        Returns an id to fetch the result later with get_llm_summary().
+        """
+        report_id = uuid.uuid4().hex
+        analysis_text = self._prepare_analysis_text(report_data)
+        self._store_result(report_id, {"status": "pending"})
+        self._pending.put((report_id, analysis_text))
+        self._ensure_worker()
+        return report_id
+
+    def get_llm_summary(self, report_id):
+        """Return the state of a queued summary, or None if the id is unknown"""
+        with self._results_lock:
+            result = self._results.get(report_id)
+            return dict(result) if result is not None else None
+
+    def _store_result(self, report_id, result):
+        with self._results_lock:
+            self._results[report_id] = result
+            self._results.move_to_end(report_id)
+            while len(self._results) > MAX_STORED_SUMMARIES:
+                self._results.popitem(last=False)
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._worker_loop, name="llm-summarizer", daemon=True
+                )
+                self._worker.start()
+
+    def _worker_loop(self):
+        """Drain pending reports and summarize them in batches"""
+        while True:
+            batch = [self._pending.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._summarize_batch(batch)
+
+    def _summarize_batch(self, batch):
+        if not self._load_model():
+            for report_id, _ in batch:
+                self._store_result(report_id, {
+                    "status": "failed",
+                    "error": "Modèle de summarization indisponible"
+                })
+            return
+
+        try:
+            outputs = self.summarizer(
+                [text for _, text in batch],
+                max_length=150,
+                min_length=50,
+                do_sample=False,
+                batch_size=len(batch)
+            )
+            for (report_id, _), output in zip(batch, outputs):
+                self._store_result(report_id, {
+                    "status": "done",
+                    "summary": output["summary_text"],
+                    "language": SUMMARY_LANGUAGE
+                })
         except Exception as e:
-            print(f"❌ Erreur lors de la génération du résumé: {e}")
-            return self._generate_template_summary(report_data)
-    
+            print(f"❌ Erreur lors de la génération du résumé LLM: {e}")
+            for report_id, _ in batch:
+                self._store_result(report_id, {"status": "failed", "error": str(e)})
+
     def _prepare_analysis_text(self, report_data):
         """Prepare detailed text for summarization"""
         text_score = report_data.get("plagiarism_score_text", 0)